@@ -0,0 +1,269 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Times the parts of the engine separately: parsing the snapshot, loading
+# it from the cache, a turn, the event tables (interpreted and compiled by
+# quill.CompiledTables), describing a location and,
+# if PyQt is installed, the same in the GUI together with the cheat panels.
+# Each benchmark is run a few times and the fastest time is kept.
+#
+#     python benchmark.py [--output results.json] [--baseline old.json]
+#
+# With --baseline, the benchmarks that got slower by more than --tolerance
+# are listed and the exit status is 1. With --profile, the script is played
+# with a quill.Profiler instead, which reports the slowest events and opcodes.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from quill import (CompiledTables, Database, Profiler, Quill, Snapshot,
+                   StringTable)
+from replay import read_log
+
+# A fixed game: the first points, then wandering around and a few
+# commands that are not understood; replay.py checks where it ends
+SCRIPT, _ = read_log(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "walkthroughs", "script.txt"))
+
+
+# Pauses would be timed too, so they are skipped
+class Game(Quill):
+    pauses = False
+
+
+# Returns the fastest of the repeats, in seconds per call
+def measure(func, number=1, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - started) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def play_script(game, state):
+    game.random.seed(0)
+    game.set_state(state)
+    for command in SCRIPT:
+        game.run_command(command)
+
+
+#######################################
+# Benchmarks
+def bench_parse(name, dbver):
+    database = Database(name, dbver)
+    sna = Snapshot(name)
+
+    def event_tables():
+        for ptr in (database.presponse, database.pprocess):
+            while sna[ptr]:
+                Quill.Event(sna, ptr, dbver)
+                ptr += 4
+
+    def string_tables():
+        for ptr, n in ((database.pobjects, database.nobjects),
+                       (database.plocations, database.nlocations),
+                       (database.pmessages, database.nmessages)):
+            StringTable(sna, sna[ptr] + 256 * sna[ptr + 1], n)
+
+    def decode_strings():
+        for table in (database.messages,
+                      database.locations[0].descriptions,
+                      database.objects[0].descriptions):
+            for i in range(len(table)):
+                table.decode(i)
+
+    return {"parse.snapshot": measure(lambda: Snapshot(name), 20),
+            "parse.find_signature": measure(sna.find_signature, 20),
+            "parse.event_tables": measure(event_tables, 5),
+            "parse.string_tables": measure(string_tables, 5),
+            "parse.decode_strings": measure(decode_strings, 5),
+            "parse.database": measure(lambda: Database(name, dbver))}
+
+
+# Loads a copy of the snapshot, so the cache of the real one is left alone
+def bench_cache(name, dbver):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmpdir, os.path.basename(name))
+        shutil.copy(name, copy)
+
+        def cold():
+            if os.path.exists(copy + ".qdb"):
+                os.remove(copy + ".qdb")
+            Database.load(copy, dbver)
+
+        results = {"load.cold": measure(cold)}
+        Database.load(copy, dbver)
+        results["load.warm"] = measure(lambda: Database.load(copy, dbver), 5)
+        return results
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_engine(database):
+    game = Game(database=database)
+    initial = game.get_state()
+    play_script(game, initial)
+    # A state in the middle of the script, for the single-step benchmarks
+    words = [game.vocabulary[w] for w in ("DAJ", "SOD")]
+
+    def turn():
+        game.output = []
+        game.run_command("DAJ SOD")
+
+    def describe():
+        game.output = []
+        game.update_location()
+
+    compiled = Game(database=database)
+    compiled.use_compiled(CompiledTables(database))
+
+    return {"engine.script": measure(lambda: play_script(game, initial), 5),
+            "engine.turn": measure(turn, 200),
+            "engine.responses": measure(
+                lambda: game.process_events(game.responses, 0, *words), 200),
+            "engine.process": measure(
+                lambda: game.process_events(game.process, 1), 200),
+            "engine.update_location": measure(describe, 200),
+            "engine.compile": measure(
+                lambda: CompiledTables(database), 1, 3),
+            "engine.compiled_script": measure(
+                lambda: play_script(compiled, initial), 5),
+            "engine.compiled_process": measure(
+                lambda: compiled.process_events(compiled.process, 1), 200)}
+
+
+def bench_gui(name, dbver):
+    try:
+        from PyQt5 import QtWidgets
+    except ImportError:
+        return {}
+    import kontrabant
+
+    class GuiGame(kontrabant.Kontrabant):
+        pauses = False
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    game = GuiGame(name, dbver)
+    initial = game.get_state()
+
+    def user_commands():
+        game.random.seed(0)
+        game.set_state(initial)
+        for command in SCRIPT:
+            game.ukazna.setText(command)
+            game.user_command()
+        app.processEvents()
+
+    def printout():
+        game.printout("Tega sploh ne razumem. Poskusi povedati kako drugače.")
+
+    return {"gui.script": measure(user_commands, 1),
+            "gui.update_location": measure(game.update_location, 100),
+            "gui.printout": measure(printout, 200),
+            "gui.goljufija": measure(game.goljufija, 20),
+            "gui.goljufija_const": measure(game.goljufija_const, 5)}
+
+
+def run(name="kontra.sna", dbver=0, gui=True):
+    results = {}
+    results.update(bench_parse(name, dbver))
+    results.update(bench_cache(name, dbver))
+    results.update(bench_engine(Database.load(name, dbver)))
+    if gui:
+        results.update(bench_gui(name, dbver))
+    return results
+
+
+# Plays the script with the profiler and returns it with the game
+def profile(name="kontra.sna", dbver=0, repeat=20):
+    game = Game(name, dbver)
+    initial = game.get_state()
+    profiler = Profiler()
+    game.set_profiler(profiler)
+    for _ in range(repeat):
+        play_script(game, initial)
+    return profiler, game
+
+
+# Returns [(benchmark, old, new)] for the benchmarks that got slower
+def regressions(results, baseline, tolerance):
+    return [(key, baseline[key], value)
+            for key, value in sorted(results.items())
+            if key in baseline and value > baseline[key] * (1 + tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engine")
+    parser.add_argument("--snapshot", default="kontra.sna")
+    parser.add_argument("--dbver", type=int, default=0)
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with results written earlier")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed slowdown, as a fraction")
+    parser.add_argument("--no-gui", action="store_true")
+    parser.add_argument("--profile", action="store_true",
+                        help="only show the events and opcodes that take "
+                             "the most time in the script")
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler, game = profile(args.snapshot, args.dbver)
+        print(profiler.report(game))
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(profiler.to_json(game))
+        return
+
+    results = run(args.snapshot, args.dbver, not args.no_gui)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    for key, value in results.items():
+        line = "%-24s %10.1f us" % (key, value * 1e6)
+        if key in baseline:
+            line += "  %+6.1f%%" % ((value / baseline[key] - 1) * 100)
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"snapshot": args.snapshot, "dbver": args.dbver,
+                       "python": sys.version.split()[0],
+                       "results": results}, f, indent=1)
+
+    slower = regressions(results, baseline, args.tolerance)
+    if slower:
+        print("\nSlower than the baseline:")
+        for key, old, new in slower:
+            print("    %s: %.1f us -> %.1f us" % (key, old * 1e6, new * 1e6))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Indexes a library of Quill snapshots: finds every .sna file in the given
+# directories, parses them in a pool of processes and writes a catalog with
+# a JSON line per file - the database version, the sizes of the tables, the
+# vocabulary and the hashes of the snapshot and of the game in it. The
+# version is guessed by trying each layout of Quill.Event.ptas in turn.
+#
+#     python catalog.py [--output catalog.jsonl] [--workers 4] DIR ...
+#
+# Snapshots are parsed directly, so no .qdb caches are written next to them.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from quill import Database, Quill
+
+
+def find_snapshots(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                if fname.lower().endswith(".sna"):
+                    yield os.path.join(root, fname)
+
+
+# With a wrong layout, the tables are read from wrong addresses; this either
+# fails while parsing or gives opcodes, locations and objects out of range
+def plausible(database):
+    nlocations = len(database.locations)
+    if not nlocations or not database.vocabulary:
+        return False
+    nactions = len(Quill.Event.ptas[database.dbver][0])
+    ncond_ops = len(Quill.Event.cond_ops)
+    for event in database.responses + database.process:
+        if any(op >= ncond_ops for op, _, _ in event.conditions) or \
+                any(op >= nactions for op, _ in event.actions):
+            return False
+    if any(dest >= nlocations for location in database.locations
+           for dest in location.connections.values()):
+        return False
+    return all(obj.initial < nlocations or
+               obj.initial >= Quill.Object.NOT_CREATED
+               for obj in database.objects)
+
+
+# Returns the database parsed with the first layout that looks right
+def probe(name, dbvers=(0, 5, 7)):
+    errors = []
+    for dbver in dbvers:
+        try:
+            database = Database(name, dbver)
+        except Exception as exc:
+            errors.append("dbver %i: %s" % (dbver, exc or type(exc).__name__))
+            continue
+        if plausible(database):
+            return database
+        errors.append("dbver %i: tables out of range" % dbver)
+    raise ValueError("; ".join(errors))
+
+
+# A hash of the game alone: the same game saved at a different moment or
+# with a different screen gives a different snapshot, but the same tables
+def game_digest(database):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(bytes([database.dbver]))
+    for table in (database.responses, database.process):
+        for event in table:
+            digest.update(bytes([event.word1, event.word2]))
+            for op, param1, param2 in event.conditions:
+                digest.update(bytes([op, param1] +
+                                    ([] if param2 is None else [param2])))
+            for op, params in event.actions:
+                digest.update(bytes((op,) + params))
+            digest.update(b"\xff")
+    for strings in (database.messages, database.locations[0].descriptions,
+                    database.objects[0].descriptions
+                    if database.objects else None):
+        if strings is not None:
+            digest.update(strings.data)
+    for location in database.locations:
+        digest.update(bytes(sum(sorted(location.connections.items()), ())))
+        digest.update(b"\xff")
+    digest.update(bytes(obj.initial for obj in database.objects))
+    digest.update(" ".join(sorted(database.vocabulary)).encode())
+    return digest.hexdigest()
+
+
+def describe(database):
+    words = {}
+    for word, index in database.vocabulary.items():
+        words.setdefault(index, []).append(word)
+    return {"dbver": database.dbver,
+            "snapshot_hash": database.db_hash.hex(),
+            "game_hash": game_digest(database),
+            "locations": len(database.locations),
+            "objects": len(database.objects),
+            "objects_carry": database.nobjects_carry,
+            "messages": len(database.messages),
+            "system_messages": len(database.system_messages),
+            "responses": len(database.responses),
+            "process": len(database.process),
+            "connections": sum(len(location.connections)
+                               for location in database.locations),
+            "vocabulary": len(database.vocabulary),
+            "words": [sorted(words[index]) for index in sorted(words)]}
+
+
+#######################################
+# Worker processes
+def index_file(name, dbvers):
+    started = time.perf_counter()
+    entry = {"file": name}
+    try:
+        entry["size"] = os.path.getsize(name)
+        entry.update(describe(probe(name, dbvers)))
+    except Exception as exc:
+        entry["error"] = str(exc) or type(exc).__name__
+    entry["seconds"] = round(time.perf_counter() - started, 6)
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index Quill snapshots")
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help="snapshots or directories with snapshots")
+    parser.add_argument("--output", metavar="FILE", default="catalog.jsonl",
+                        help="the catalog, a JSON line per file "
+                             "(- for standard output)")
+    parser.add_argument("--dbver", type=int, choices=(0, 5, 7),
+                        help="do not guess the database version")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes (default: one per core)")
+    args = parser.parse_args()
+
+    names = list(find_snapshots(args.paths))
+    dbvers = (args.dbver,) if args.dbver is not None else (0, 5, 7)
+    nworkers = args.workers or os.cpu_count()
+    started = time.perf_counter()
+    nfailed = 0
+    out = sys.stdout if args.output == "-" else \
+        open(args.output, "w", encoding="utf-8")
+    # The progress goes to stderr when the catalog goes to stdout
+    log = sys.stderr if out is sys.stdout else sys.stdout
+    try:
+        with ProcessPoolExecutor(nworkers) as pool:
+            n = len(names)
+            for entry in pool.map(index_file, names, [dbvers] * n,
+                                  chunksize=max(1, n // (4 * nworkers))):
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                if "error" in entry:
+                    nfailed += 1
+                    print("%s: %s" % (entry["file"], entry["error"]),
+                          file=log)
+                else:
+                    print("%s: dbver %i, %i locations, %.1f ms"
+                          % (entry["file"], entry["dbver"],
+                             entry["locations"], entry["seconds"] * 1000),
+                          file=log)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print("%i files (%i failed) in %.2f s, %.1f files/s"
+          % (len(names), nfailed, elapsed,
+             len(names) / elapsed if elapsed else 0), file=log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Plays random games to find commands that break the engine: exceptions,
+# objects or the player in places that do not exist, and flags[1] that does
+# not match the number of objects carried. Flags are bytes of Quill.state,
+# so a value outside 0..255 shows up as a ValueError when it is stored.
+#
+# Every game starts from the initial state with the random generator seeded
+# by its number, so it can be replayed. For each kind of problem, the first
+# game that ran into it is shrunk to as few commands as still reproduce it.
+#
+#     python fuzz.py [--commands 1000000] [--workers 4] [--seed 0]
+
+import argparse
+import json
+import os
+import random
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from quill import Quill
+
+
+class FuzzGame(Quill):
+    # Nothing is undone, so no history is kept; pauses would only slow
+    # the games down
+    history_size = 0
+    pauses = False
+
+    # Commands the game reacts to, and all words for the random ones
+    def prepare_commands(self):
+        self.guided = self.known_commands()
+        self.words = sorted(self.vocabulary)
+        self.initial = self.get_state()
+
+    def random_command(self, rand):
+        if rand.random() < 0.8:
+            return rand.choice(self.guided)
+        return " ".join(rand.choice(self.words)
+                        for _ in range(rand.randint(1, 3)))
+
+    # Returns (kind, description) of the first problem, or None
+    def check(self):
+        if self.location_no >= len(self.locations):
+            return "location", "at location %i" % self.location_no
+        carried = 0
+        for objno, loc in enumerate(self.object_locations):
+            if loc in (self.Object.CARRIED, self.Object.WORN):
+                carried += 1
+            elif len(self.locations) <= loc < self.Object.NOT_CREATED:
+                return "object location", \
+                    "object %i at location %i" % (objno, loc)
+        # 255 means that the count is not kept (see do_get)
+        if self.flags[1] != 255 and self.flags[1] != carried:
+            return "carried count", \
+                "flags[1] = %i, carrying %i" % (self.flags[1], carried)
+        return None
+
+    # Plays the commands from the initial state; returns the number of
+    # commands played up to the first problem and the problem, if any
+    def play(self, commands, seed):
+        self.set_state(self.initial)
+        self.turns = 0
+        self.random.seed(seed)
+        for i, command in enumerate(commands):
+            try:
+                self.command(command)
+            except Exception as exc:
+                frame = traceback.extract_tb(exc.__traceback__)[-1]
+                kind = "%s at %s:%i" % (type(exc).__name__,
+                                        frame.filename.split("/")[-1],
+                                        frame.lineno)
+                return i + 1, (kind, str(exc))
+            problem = self.check()
+            if problem:
+                return i + 1, problem
+        return len(commands), None
+
+    # Removes chunks of commands for as long as the same kind of problem
+    # still shows up
+    def minimize(self, commands, seed, kind):
+        chunks = 2
+        while len(commands) > 1:
+            size = -(-len(commands) // chunks)
+            for start in range(0, len(commands), size):
+                candidate = commands[:start] + commands[start + size:]
+                played, problem = self.play(candidate, seed)
+                if problem and problem[0] == kind:
+                    commands = candidate[:played]
+                    chunks = max(chunks - 1, 2)
+                    break
+            else:
+                if chunks >= len(commands):
+                    break
+                chunks = min(len(commands), 2 * chunks)
+        return commands
+
+
+#######################################
+# Worker processes
+# Plays games first_game, first_game + stride, first_game + 2 * stride, ...
+def fuzz(name, dbver, first_game, stride, ncommands, game_length):
+    started = time.perf_counter()
+    game = FuzzGame(name, dbver)
+    game.prepare_commands()
+    problems = {}
+    played = 0
+    seed = first_game
+    while played < ncommands:
+        rand = random.Random(seed)
+        commands = [game.random_command(rand) for _ in range(game_length)]
+        n, problem = game.play(commands, seed)
+        played += n
+        if problem:
+            kind, description = problem
+            if kind in problems:
+                problems[kind]["count"] += 1
+            else:
+                log = game.minimize(commands[:n], seed, kind)
+                problems[kind] = {"description": description, "count": 1,
+                                  "seed": seed, "commands": log}
+        seed += stride
+    return played, time.perf_counter() - started, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the Quill engine")
+    parser.add_argument("--snapshot", default="kontra.sna")
+    parser.add_argument("--dbver", type=int, default=0)
+    parser.add_argument("--commands", type=int, default=1000000,
+                        help="number of commands per worker")
+    parser.add_argument("--game-length", type=int, default=200)
+    parser.add_argument("--workers", type=int,
+                        help="number of processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="FILE",
+                        help="also write the problems to a file")
+    args = parser.parse_args()
+
+    nworkers = args.workers or os.cpu_count()
+    with ProcessPoolExecutor(nworkers) as pool:
+        # The workers take turns at game numbers, so that none plays a game
+        # of another however many games it ends up playing
+        results = list(pool.map(
+            fuzz, [args.snapshot] * nworkers, [args.dbver] * nworkers,
+            [args.seed + i for i in range(nworkers)], [nworkers] * nworkers,
+            [args.commands] * nworkers, [args.game_length] * nworkers))
+
+    problems = {}
+    for _, _, found in results:
+        for kind, problem in found.items():
+            known = problems.get(kind)
+            if known is None:
+                problems[kind] = problem
+            else:
+                known["count"] += problem["count"]
+                if len(problem["commands"]) < len(known["commands"]):
+                    count = known["count"]
+                    known.update(problem, count=count)
+
+    for kind, problem in sorted(problems.items()):
+        print("%s (%i times): %s" % (kind, problem["count"],
+                                     problem["description"]))
+        print("    seed %i: %s" % (problem["seed"],
+                                   " / ".join(problem["commands"])))
+    played = sum(n for n, _, _ in results)
+    cpu_time = sum(t for _, t, _ in results)
+    print("%i commands, %.0f commands/s per core, %i workers"
+          % (played, played / cpu_time, nworkers))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(problems, f, indent=1, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
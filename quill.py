@@ -0,0 +1,1627 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## During development I peeked a lot at Unquill from John Elliott, 1996-2000.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+import hashlib
+import html
+import importlib.util
+import json
+import marshal
+import mmap
+import pickle
+import random
+import re
+import time
+from array import array
+from collections import deque
+from functools import lru_cache, partial
+
+import savestore
+
+# Turns the HTML that Quill prints into plain text
+def plain_text(text):
+    text = re.sub(r"(?i)<br>|<p>|</?ul>", "\n", text)
+    text = re.sub(r"(?i)<li>", "\n- ", text)
+    return html.unescape(re.sub(r"<[^>]*>?", "", text))
+
+
+# A 48K .sna file, memory-mapped. Indices are Spectrum addresses: the file
+# has 27 bytes of registers followed by the RAM from 16384 on. Addresses
+# below the snapshot (the ROM) read as zero.
+class Snapshot:
+    BASE = 16384 - 27
+    signature = re.compile(rb"\x10.\x11.\x12.\x13.\x14.\x15", re.DOTALL)
+
+    def __init__(self, name):
+        with open(name, "rb") as f:
+            self.data = memoryview(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            start, stop = addr.start - self.BASE, addr.stop - self.BASE
+            return self.data[max(start, 0):max(stop, 0):addr.step]
+        addr -= self.BASE
+        return self.data[addr] if addr >= 0 else 0
+
+    def offset(self, addr):
+        return addr - self.BASE
+
+    def digest(self):
+        return hashlib.blake2b(self.data, digest_size=16).digest()
+
+    def find_signature(self):
+        match = self.signature.search(self.data)
+        if not match:
+            raise ValueError("Quill signature not found")
+        return match.start() + self.BASE
+
+
+# A table of strings (messages, descriptions of objects or locations).
+# Reading the table only finds where each string starts; a string is decoded
+# into HTML when first used, and the most recently used ones are kept.
+class StringTable:
+    colors = ["#000000", "#0000ff", "#ff0000", "#ff00ff", "#00ff00",
+              "#00ffff", "#ffff00", "#ffffff"]
+    replacs = {"&": "&amp", "<": "&lt;", ">": "&gt;", "\x60": "&pound;",
+               "\x7f": "&copy;", "\x95": "č", "\x94": "š", "\xa0": "ž",
+               "\x92": "Č", "\xa2": "Š", "\x90": "Ž"}
+    # How would these codes be reset?
+    # codes = {"\x12": "<big>", "\x13": "<b>", "\x14": "<i>", "\x15": "<u>"}
+
+    # A string ends with 0x1f; INK and PAPER are followed by a parameter
+    # (the bytes are stored inverted)
+    item = re.compile(rb"(?:[\xee\xef].|[^\xe0])*\xe0", re.DOTALL)
+
+    def __init__(self, sna, ptr, n, cache_size=256):
+        data = sna.data
+        start = ptr = sna.offset(ptr)
+        # The whole snapshot is 48K, so offsets fit into 16 bits
+        self.offsets = array("H")
+        for i in range(n):
+            self.offsets.append(ptr - start)
+            match = self.item.match(data, ptr)
+            if match is None:
+                raise ValueError("unterminated string table")
+            ptr = match.end()
+        # A view into the snapshot, copied only when pickled
+        self.data = data[start:ptr]
+        self.cache_size = cache_size
+        self.prepare()
+
+    def prepare(self):
+        self.get = lru_cache(self.cache_size)(self.decode)
+
+    def __getstate__(self):
+        return bytes(self.data), self.offsets, self.cache_size
+
+    def __setstate__(self, state):
+        self.data, self.offsets, self.cache_size = state
+        self.prepare()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return self.get(i)
+
+    def decode(self, i):
+        sna = self.data
+        ptr = self.offsets[i]
+        colors, replacs = self.colors, self.replacs
+        s = ""
+        xpos = 0
+        while 1:
+            c = chr(255 - sna[ptr])
+            ptr += 1
+            if c in replacs:
+                s += replacs[c]
+                xpos += 1
+            elif c >= ' ':
+                s += c
+                xpos += 1
+            elif c == "\x1f":
+                break
+            elif c == "\x06":
+                if 255 - sna[ptr] == 6:
+                    s += "<P>"
+                    xpos = 0
+                    ptr += 1
+                else:
+                    s += " "
+                    xpos = 0
+            elif c == "\x10":  # INK
+                cl = 255 - sna[ptr]
+                ptr += 1
+                if cl < 8:
+                    s += "<FONT COLOR=%s>" % colors[cl]
+            elif c == "\x11":  # PAPER
+                ptr += 1
+            # elif c in codes:
+            #     if sna[ptr] != 255:
+            #         s += "<%s>" % codes[c]
+            #     else:
+            #         s += "</%s>" % codes[c]
+            #     ptr += 1
+            if xpos == 32:
+                if sna[ptr] != ' ':
+                    s += " "
+                xpos = 0
+        return s
+
+
+class Quill:
+    class Event:
+        # Events are kept compact: no __dict__, conditions are stored only
+        # as tests, and the Database shares equal tests and actions among
+        # its events (see share)
+        __slots__ = ("dbver", "word1", "word2", "tests", "actions")
+
+        NIL, LOC, MSG, OBJ, SWAP, PLC = tuple(range(100, 106))
+        # data.state[-1] is the current location, see Quill.location_no
+        cond_ops = [("AT", "data.state[-1] == param1"),
+                    ("NOT AT", "data.state[-1] != param1"),
+                    ("AT GT", "data.state[-1] > param1"),
+                    ("AT LT", "data.state[-1] < param1"),
+                    ("PRESENT",
+                     "data.object_locations[param1] == data.state[-1]"),
+                    ("ABSENT",
+                     "data.object_locations[param1] != data.state[-1]"),
+                    ("WORN",
+                     "data.object_locations[param1] == data.Object.WORN"),
+                    ("NOT WORN",
+                     "data.object_locations[param1] != data.Object.WORN"),
+                    ("CARRIED",
+                     "data.object_locations[param1] == data.Object.CARRIED"),
+                    ("NOT CARR",
+                     "data.object_locations[param1] != data.Object.CARRIED"),
+                    ("CHANCE", "param1 < data.random.randint(1, 100)"),
+                    ("ZERO", "not data.flags[param1]"),
+                    ("NOT ZERO", "data.flags[param1]"),
+                    ("EQ", "data.flags[param1]==param2"),
+                    ("GT", "data.flags[param1]>param2"),
+                    ("LT", "data.flags[param1]<param2")]
+        # Conditions compiled once, so matching an event needs no parsing
+        cond_funcs = [eval("lambda data, param1, param2: " + expr)
+                      for _, expr in cond_ops]
+        cond_opcodes = {func: opcode for opcode, func in enumerate(cond_funcs)}
+
+        ptas = {
+            0: (["INVEN", "DESC", "QUIT", "END", "DONE", "OK",
+                 "ANYKEY", "SAVE", "LOAD", "TURNS", "SCORE",
+                 "PAUSE", "GOTO", "MESSAGE", "REMOVE", "GET",
+                 "DROP", "WEAR", "DESTROY", "CREATE", "SWAP",
+                 "SET", "CLEAR", "PLUS", "MINUS", "LET", "BEEP"],
+                [0] * 11 + [1] * 9 + [2, 1, 1] + [2]*16,
+                [NIL] * 12 + [LOC, MSG] + [OBJ] * 6 + [SWAP] + [NIL] * 18),
+            5: (["INVEN", "DESC", "QUIT", "END", "DONE", "OK",
+                 "ANYKEY", "SAVE", "LOAD", "TURNS", "SCORE",
+                 "CLS", "DROPALL", "PAUSE", "PAPER", "INK",
+                 "BORDER", "GOTO", "MESSAGE", "REMOVE", "GET",
+                 "DROP", "WEAR", "DESTROY", "CREATE", "SWAP",
+                 "PLACE", "SET", "CLEAR", "PLUS", "MINUS",
+                 "LET", "BEEP"],
+                [0] * 13 + [1] * 12 + [2, 2, 1, 1] + [2] * 10,
+                [NIL] * 17 + [LOC, MSG] + [OBJ] * 6 + [SWAP, PLC] + [NIL]*12),
+            7: (["INVEN", "DESC", "QUIT", "END", "DONE", "OK",
+                 "ANYKEY", "SAVE", "LOAD", "TURNS", "SCORE",
+                 "CLS", "DROPALL", "AUTOG", "AUTOD", "AUTOW",
+                 "AUTOR", "PAUSE", "PAPER", "INK", "BORDER",
+                 "GOTO", "MESSAGE", "REMOVE", "GET", "DROP",
+                 "WEAR", "DESTROY", "CREATE", "SWAP", "PLACE",
+                 "SET", "CLEAR", "PLUS", "MINUS", "LET", "BEEP"],
+                [0] * 17 + [1] * 12 + [2, 2, 1] + [2] * 7,
+                [NIL] * 21 + [LOC, MSG] + [OBJ] * 6 + [SWAP, PLC] + [NIL] * 8)}
+
+        def __init__(self, sna, ptr, dbver=0):
+            self.dbver = dbver
+            self.word1 = sna[ptr]
+            self.word2 = sna[ptr + 1]
+            p = sna[ptr + 2] + 256 * sna[ptr + 3]
+
+            conditions = []
+            while sna[p] != 0xff:
+                opcode = sna[p]
+                param1 = sna[p + 1]
+                if opcode > 12:
+                    param2 = sna[p + 2]
+                    p += 3
+                else:
+                    param2 = None
+                    p += 2
+                conditions.append((opcode, param1, param2))
+
+            p += 1
+            actions = []
+            nparams = self.ptas[dbver][1]
+            while sna[p] != 0xff:
+                opcode = sna[p]
+                params = tuple(sna[p + 1:p + 1 + nparams[opcode]])
+                actions.append((opcode, params))
+                p += 1 + nparams[opcode]
+            self.prepare(conditions, actions)
+
+        # Compiled tests are not pickled, but rebuilt
+        def prepare(self, conditions, actions):
+            self.tests = tuple((self.cond_funcs[opcode], param1, param2)
+                               for opcode, param1, param2 in conditions)
+            self.actions = tuple((opcode, params)
+                                 for opcode, params in actions)
+
+        # Replaces tests and actions with the equal ones in shared, and adds
+        # those that are not there yet
+        def share(self, shared):
+            self.tests = tuple(shared.setdefault(test, test)
+                               for test in self.tests)
+            self.actions = tuple(
+                shared.setdefault(action, action) for action in
+                ((opcode, shared.setdefault(params, params))
+                 for opcode, params in self.actions))
+
+        # Read-only views for the cheat panels and the cross reference
+        @property
+        def conditions(self):
+            cond_opcodes = self.cond_opcodes
+            return [(cond_opcodes[test], param1, param2)
+                    for test, param1, param2 in self.tests]
+
+        @property
+        def act_ops(self):
+            return self.ptas[self.dbver][0]
+
+        @property
+        def nparams(self):
+            return self.ptas[self.dbver][1]
+
+        @property
+        def types(self):
+            return self.ptas[self.dbver][2]
+
+        def __getstate__(self):
+            return (self.dbver, self.word1, self.word2,
+                    self.conditions, self.actions)
+
+        def __setstate__(self, state):
+            (self.dbver, self.word1, self.word2,
+             conditions, actions) = state
+            self.prepare(conditions, actions)
+
+        # returns: -1 for error,
+        #           0 for not matching,
+        #           1 for matching and done (no further processing),
+        #           2 for matching, but process further
+        def __call__(self, data, system, word1, word2):
+            if system or self.matches(word1, word2):
+                for test, param1, param2 in self.tests:
+                    if not test(data, param1, param2):
+                        return 0
+                return self.run_actions(data, 0)
+            return 0
+
+        # 255 stands for a word that the command must not have
+        def matches(self, word1, word2):
+            return (word1 == self.word1 or not word1 and self.word1 == 255) \
+                and (word2 == self.word2 or not word2 and self.word2 == 255)
+
+        # Leaves the actions after the i-th for Suspend.resume; this is not
+        # done in run_actions, where a closure would slow down every call
+        def suspended(self, suspend, data, i):
+            suspend.then(lambda res: res or self.run_actions(data, i + 1))
+
+        def run_actions(self, data, start):
+            handlers = data.handlers
+            actions = self.actions
+            for i in range(start, len(actions)):
+                opcode, params = actions[i]
+                try:
+                    res = handlers[opcode](*params)
+                except Quill.Suspend as suspend:
+                    self.suspended(suspend, data, i)
+                    raise
+                if res:
+                    return res
+            return 2
+
+    # Raised by PAUSE, and by an anykey() that does not want to block, while
+    # a turn runs through start_turn. Each function on the way up adds what
+    # it has left to do, so that resume() can finish the turn later
+    class Suspend(Exception):
+        def __init__(self, delay=None):
+            Exception.__init__(self, delay)
+            self.delay = delay  # in seconds; None waits for a key
+            self.rest = []
+
+        def then(self, func):
+            self.rest.append(func)
+
+        # Calls the functions in turn, each with the result of the previous
+        def resume(self):
+            value = None
+            for i, func in enumerate(self.rest):
+                try:
+                    value = func(value)
+                except Quill.Suspend as suspend:
+                    suspend.rest += self.rest[i + 1:]
+                    raise
+            return value
+
+    # Descriptions are looked up in the database's StringTable when needed
+    class Location:
+        __slots__ = ("descriptions", "index", "connections")
+
+        def __init__(self, descriptions, index, conn=None):
+            self.descriptions = descriptions
+            self.index = index
+            self.connections = conn or {}
+
+        @property
+        def description(self):
+            return self.descriptions[self.index]
+
+    class Object:
+        INVALID, CARRIED, WORN, NOT_CREATED = 0xff, 0xfe, 0xfd, 0xfc
+        __slots__ = ("descriptions", "index", "initial")
+
+        def __init__(self, descriptions, index, initial=NOT_CREATED):
+            self.descriptions = descriptions
+            self.index = index
+            self.initial = initial
+
+        @property
+        def description(self):
+            return self.descriptions[self.index]
+
+    #######################################
+    # Actions
+    def do_get(self, param1):
+        loc = self.object_locations[param1]
+        if loc == self.Object.WORN or loc == self.Object.CARRIED:
+            self.printout("To vendar že nosim!")
+            return -1
+        elif loc != self.location_no:
+            self.printout("Saj ni tukaj.")
+            return -1
+        elif self.flags[1] == self.nobjects_carry:
+            return -1
+        else:
+            self.object_locations[param1] = self.Object.CARRIED
+            # Starts at 255 (see __init__) and saturates, so the carrying
+            # limit never applies
+            if self.flags[1] < 255:
+                self.flags[1] += 1
+
+    def do_wear(self, param1):
+        loc = self.object_locations[param1]
+        if loc == self.Object.WORN:
+            self.printout("To vendar že nosim!")
+            return -1
+        elif loc != self.Object.CARRIED:
+            self.printout("Tega sploh nimam!")
+            return -1
+        else:
+            self.object_locations[param1] = self.Object.WORN
+
+    def do_drop(self, param1):
+        loc = self.object_locations[param1]
+        if (loc == self.Object.WORN) or (loc == self.Object.CARRIED):
+            self.object_locations[param1] = self.location_no
+        else:
+            self.printout("Tega sploh nimam.")
+            return -1
+
+    def do_remove(self, param1):
+        loc = self.object_locations[param1]
+        if loc != self.Object.WORN:
+            self.printout("Tega sploh ne nosim!")
+            return -1
+        else:
+            self.object_locations[param1] = self.Object.CARRIED
+
+    def do_dropall(self):
+        for objno, loc in enumerate(self.object_locations):
+            if loc == self.Object.WORN or loc == self.Object.CARRIED:
+                self.object_locations[objno] = self.location_no
+        self.flags[1] = 0
+
+    def do_goto(self, locno):
+        self.location_no = locno
+        self.flags[2] = locno
+
+    def do_create(self, objno):
+        loc = self.object_locations[objno]
+        if loc == self.Object.WORN or loc == self.Object.CARRIED:
+            if self.flags[1]:
+                self.flags[1] -= 1
+        self.object_locations[objno] = self.location_no
+
+    def do_destroy(self, objno):
+        loc = self.object_locations[objno]
+        if loc == self.Object.WORN or loc == self.Object.CARRIED:
+            if self.flags[1]:
+                self.flags[1] -= 1
+        self.object_locations[objno] = self.Object.NOT_CREATED
+
+    def do_place(self, objno, locno):
+        loc = self.object_locations[objno]
+        if loc == self.Object.WORN or loc == self.Object.CARRIED:
+            if self.flags[1]:
+                self.flags[1] -= 1
+        self.object_locations[objno] = locno
+
+    def do_print(self, flagno):
+        if flagno > 47:
+            self.printout(self.flags[flagno] + 256 * self.flags[flagno+1])
+        else:
+            self.printout(self.flags[flagno])
+
+    # Flags above 47 are low bytes of 16-bit counters; the others saturate
+    def do_plus(self, flagno, no):
+        value = self.flags[flagno] + no
+        if value > 255:
+            if flagno > 47:
+                value -= 256
+                self.flags[flagno + 1] = (self.flags[flagno + 1] + 1) % 256
+            else:
+                value = 255
+        self.flags[flagno] = value
+
+    def do_minus(self, flagno, no):
+        value = self.flags[flagno] - no
+        if value < 0:
+            if flagno > 47:
+                value += 256
+                self.flags[flagno + 1] = (self.flags[flagno + 1] - 1) % 256
+            else:
+                value = 0
+        self.flags[flagno] = value
+
+    def do_inven(self):
+        inv = ""
+        for obj, loc in zip(self.objects, self.object_locations):
+            if loc == Quill.Object.CARRIED:
+                inv += "<LI>%s</LI>" % obj.description
+            elif loc == Quill.Object.WORN:
+                inv += "<LI>%s (nosim)</LI>" % obj.description
+        if inv:
+            inv = "Prenašam pa tole:<UL>"+inv+"</UL"
+        else:
+            inv = "Prenašam pa tole:<UL>pravzaprav nič</UL"
+        self.printout(inv)
+
+    def do_message(self, msgno):
+        self.printout(self.messages[msgno])
+
+    do_mes = do_message
+
+    def do_set(self, flagno):
+        self.flags[flagno] = 255
+
+    def do_clear(self, flagno):
+        self.flags[flagno] = 0
+
+    def do_let(self, flagno, no):
+        self.flags[flagno] = no
+
+    def do_add(self, flg1, flg2):
+        return self.do_plus(flg1, self.flags[flg2])
+
+    def do_sum(self, flg1, flg2):
+        return self.do_minus(flg1, self.flags[flg2])
+
+    def do_swap(self, obj1, obj2):
+        locs = self.object_locations
+        locs[obj1], locs[obj2] = locs[obj2], locs[obj1]
+
+    def do_desc(self):
+        self.update_location()
+
+    def do_quit(self):
+        self.then(self.reset, lambda _: self.update_location())
+
+    def do_end(self):
+        self.then(self.do_anykey, lambda _: self.do_quit())
+
+    def do_ok(self):
+        self.printout("OK")
+        return 1
+
+    def do_done(self):
+        return 1
+
+    def do_anykey(self):
+        if self.pauses:
+            self.anykey()
+
+    def do_save(self):
+        self.printout("Shranjevati pa še ne znam ...")
+
+    def do_load(self):
+        self.printout("Nalagati pa znam ...")
+
+    def do_autog(self):
+        self.printout("'AUTOG' ni implementiran")
+
+    def do_autod(self):
+        self.printout("'AUTOD' ni implementiran")
+
+    def do_autow(self):
+        self.printout("'AUTOW' ni implementiran")
+
+    def do_autor(self):
+        self.printout("'AUTOR' ni implementiran")
+
+    def do_star(self, _):
+        self.printout("'STAR' ni implementiran")
+
+    def do_jsr(self, *_):
+        self.printout("'JSR' ni implementiran")
+
+    def do_sound(self, lsb, msg):
+        pass
+
+    def do_beep(self, lsb, msg):
+        pass
+
+    def do_turns(self):
+        self.printout("Ukazov dal si %4i zares<br>" % self.turns)
+
+    def do_score(self):
+        self.printout("Nabral si %i odstotkov<br>" % self.flags[30])
+
+    def do_pause(self, s50):
+        if not self.pauses:
+            return
+        if self.suspending:
+            raise self.Suspend(s50 / 50)
+        time.sleep(s50/50)
+
+    def do_cls(self):
+        pass
+
+    def do_paper(self, _):
+        pass
+
+    do_ink = do_border = do_paper
+
+    #######################################
+    # Initialization
+    # True while a turn runs through start_turn or resume
+    suspending = False
+    # False skips PAUSE and ANYKEY, for games that nobody watches
+    pauses = True
+    # The number of turns that can be undone
+    history_size = 1000
+    # True during travel, whose steps are not recorded as turns of their own
+    walking = False
+    # Functions from CompiledTables, see use_compiled
+    compiled = None
+
+    # With compiled, the event tables are run by CompiledTables for the
+    # snapshot of the database (which are cached next to it)
+    def __init__(self, name="kontra.sna", dbver=0, database=None, seed=None,
+                 compiled=False):
+        self.set_database(database or Database.load(name, dbver))
+        if compiled:
+            self.use_compiled(CompiledTables.load(self.database))
+        # CHANCE draws from this, so a game with a given seed always
+        # plays out the same
+        self.random = random.Random(seed)
+
+        # Flags, object locations and the current location share one buffer,
+        # so a whole game state is copied or compared with bytes(self.state)
+        nobjects = len(self.objects)
+        self.state = bytearray(64 + nobjects + 1)
+        self.flags = memoryview(self.state)[:64]
+        self.object_locations = memoryview(self.state)[64:64 + nobjects]
+        self.location_no = 1
+        self.flags[1] = 255
+        self.flags[2] = self.location_no
+
+        self.turns = 0
+        self.output = []
+        self.turn_start = self.get_state()
+        self.reset()
+
+        # Changes of the state in past turns, see record_turn
+        self.history = deque(maxlen=self.history_size)
+        self.undone = []
+        self.history_base = self.get_state()
+        # Offsets into the state fit into bytes unless there are many objects
+        self.delta_type = "B" if len(self.state) <= 256 else "H"
+
+    # The parsed game is never changed while playing, so any number of
+    # Quills can share one Database; each only has its own state
+    # Compiled tables belong to the old database, so they are dropped
+    def set_database(self, database):
+        self.database = database
+        vars(self).update(vars(database))
+        self.handlers = self.action_handlers()
+        if self.compiled:
+            self.use_compiled()
+
+    # Action opcodes are resolved to bound methods once, not per call
+    def action_handlers(self):
+        return [getattr(self, "do_" + name.lower())
+                for name in self.Event.ptas[self.dbver][0]]
+
+    @property
+    def location_no(self):
+        return self.state[-1]
+
+    @location_no.setter
+    def location_no(self, locno):
+        self.state[-1] = locno
+
+    @property
+    def location(self):
+        return self.locations[self.state[-1]]
+
+    def get_state(self):
+        return bytes(self.state)
+
+    def set_state(self, state):
+        self.state[:] = state
+
+    #######################################
+    # Processing
+    def reset(self):
+        self.flags[2] = self.location_no = 0
+        self.turns = 0
+        self.object_locations[:] = bytes(obj.initial for obj in self.objects)
+        self.update_location()
+        self.process_events(self.process, 1)
+
+    def update_location(self):
+        self.clear_screen()
+        if self.flags[0]:
+            self.set_location_description(
+                "Temno je kot v rogu. Nič ne vidim.", (0,) * 12)
+            return
+
+        desc = self.location.description
+        inv = [obj.description
+               for obj, loc in zip(self.objects, self.object_locations)
+               if loc == self.location_no]
+        if len(inv) == 1:
+            desc += "<br>Vidim tudi " + inv[0] + "<br>"
+        elif inv:
+            desc += "<br>Vidim tudi: " + "".join("<br>- %s" % i for i in inv)
+        self.set_location_description(
+            desc, [direct in self.location.connections
+                   for direct in self.dir_codes])
+
+    #######################################
+    # Controller
+    def process_events(self, table, system, word1=None, word2=None):
+        match = 0
+        try:
+            for event in table:
+                res = event(self, system, word1, word2)
+                if res in [-1, 1]:
+                    return res
+                elif res:
+                    match = 1
+        except self.Suspend as suspend:
+            self.suspended_at(suspend, table, table.index(event), match,
+                              system, word1, word2)
+            raise
+        return match
+
+    # Leaves the events after the k-th event of the table for Suspend.resume
+    def suspended_at(self, suspend, table, k, match, system, word1, word2):
+        suspend.then(partial(self.after_event,
+                             match=match, rest=table[k + 1:], system=system,
+                             word1=word1, word2=word2))
+
+    # Continues process_events after the event that suspended the turn
+    def after_event(self, res, match, rest, system, word1, word2):
+        if res in [-1, 1]:
+            return res
+        return self.process_events(rest, system, word1, word2) or \
+            match or int(bool(res))
+
+    # Returns after(first()); if first suspends the turn, after is left
+    # for Suspend.resume
+    def then(self, first, after):
+        try:
+            value = first()
+        except self.Suspend as suspend:
+            suspend.then(after)
+            raise
+        return after(value)
+
+    # Maps (word1, word2) to the matching events, in table order; 255 stands
+    # for a missing word, as in Event.__call__
+    @staticmethod
+    def index_events(table):
+        index = {}
+        for event in table:
+            index.setdefault((event.word1, event.word2), []).append(event)
+        return index
+
+    # Runs the events through the profiler, or, without one, as usual; when
+    # profiling is off, there is no trace of it in process_events or handlers
+    def set_profiler(self, profiler=None):
+        self.profiler = profiler
+        self.handlers = self.action_handlers()
+        if profiler is None:
+            vars(self).pop("process_events", None)
+            if self.compiled:
+                self.process_events = self.run_compiled
+        else:
+            self.handlers = [profiler.timed(opcode, handler)
+                             for opcode, handler in enumerate(self.handlers)]
+            self.process_events = partial(profiler.process_events, self)
+
+    # Runs the event tables with the functions from CompiledTables instead
+    # of interpreting them; None goes back to the interpreter. The functions
+    # are keyed by the identity of the tables, so they only fit the database
+    # they were compiled for.
+    def use_compiled(self, tables=None):
+        if tables is not None and tables.database is not self.database:
+            raise ValueError("compiled tables are for a different database")
+        self.compiled = tables and tables.functions
+        if tables is None:
+            if getattr(self, "profiler", None) is None:
+                vars(self).pop("process_events", None)
+        elif getattr(self, "profiler", None) is None:
+            self.process_events = self.run_compiled
+
+    # Tables that were not compiled, like the rest of a table after a pause,
+    # are interpreted
+    def run_compiled(self, table, system, word1=None, word2=None):
+        func = self.compiled.get(id(table))
+        if func is None:
+            return Quill.process_events(self, table, system, word1, word2)
+        return func(self, table, system, word1, word2)
+
+    def responses_for(self, word1, word2=None):
+        return self.response_index.get((word1 or 255, word2 or 255), ())
+
+    # The commands the game reacts to: the words and word pairs of the
+    # response table and the directions, each once
+    def known_commands(self):
+        words = self.index_to_word
+        keys = [key for key in self.response_index if key[0] != 255]
+        keys += [(d, 255) for d in self.dir_codes if (d, 255) not in keys]
+        return [words[w1] if w2 == 255 else "%s %s" % (words[w1], words[w2])
+                for w1, w2 in keys]
+
+    # Runs a single command and returns the text it printed
+    def command(self, command):
+        self.output = []
+        self.run_command(command.upper())
+        return "".join(msg + "<br>" for msg in self.output)
+
+    def run_command(self, command):
+        self.turn_start = self.get_state()
+        if not self.walking:
+            self.record_turn(self.turn_start)
+
+        commsplit = command.split()
+        # Each step is a turn of its own
+        dest = self.travel_destination(commsplit)
+        if dest is not None:
+            self.travel(dest)
+            return
+
+        self.turns += 1
+        if commsplit and (commsplit[0] in ["SHRA", "SAVE"]):
+            self.save()
+            return
+
+        if commsplit and (commsplit[0] in ["NALO", "LOAD"]):
+            self.load()
+            return
+
+        if commsplit and (commsplit[0] in ["NAZAJ", "UNDO"]):
+            if self.undo():
+                self.update_location()
+            else:
+                self.printout("Ni česa razveljaviti.")
+            return
+
+        if commsplit and (commsplit[0] in ["NAPREJ", "REDO"]):
+            if self.redo():
+                self.update_location()
+            else:
+                self.printout("Ni česa ponoviti.")
+            return
+
+        trans = []
+        for w in commsplit:
+            t = self.vocabulary.get(w[:4], None)
+            if t:
+                trans.append(t)
+
+        if not len(trans):
+            self.printout("Tega sploh ne razumem. "
+                          "Poskusi povedati kako drugače.")
+
+        elif len(trans) == 1 and trans[0] in self.location.connections:
+            self.flags[2] = self.location_no = \
+                self.location.connections[trans[0]]
+            self.update_location()
+
+        else:
+            words = trans[:2]
+            self.then(
+                lambda: self.process_events(self.responses_for(*words),
+                                            0, *words),
+                lambda m: self.end_turn(words if m == 0 else None))
+            return
+
+        self.end_turn()
+
+    #######################################
+    # Travel
+    # POJDI 42, GOTO 42 or GO TO 42 return 42; other commands None
+    @staticmethod
+    def travel_destination(commsplit):
+        if len(commsplit) == 2 and commsplit[0] in ["POJDI", "GOTO"] or \
+                len(commsplit) == 3 and commsplit[:2] == ["GO", "TO"]:
+            if commsplit[-1].isdigit():
+                return int(commsplit[-1])
+        return None
+
+    # Returns the directions of a shortest way from the location src (or
+    # the current location) to dest, or None if there is no way
+    def route(self, dest, src=None):
+        loc = self.location_no if src is None else src
+        if not (0 <= loc < len(self.locations) and
+                0 <= dest < len(self.locations)):
+            return None
+        path = []
+        while loc != dest:
+            direction = self.routes[loc][dest]
+            if direction == 255:
+                return None
+            path.append(direction)
+            loc = self.locations[loc].connections[direction]
+        return path
+
+    # Walks to dest, a command per step, as if the player typed them; the
+    # way is looked up again from wherever each step leads, and walking
+    # stops if a step does not get where the connection says (when an event
+    # moves the player, for instance). Returns whether the player got there
+    def go_to(self, dest):
+        while self.location_no != dest:
+            route = self.route(dest)
+            if not route:
+                return False
+            expected = self.location.connections[route[0]]
+            try:
+                self.run_command(self.index_to_word[route[0]])
+            except self.Suspend as suspend:
+                suspend.then(lambda _: self.location_no == expected and
+                             self.go_to(dest))
+                raise
+            if self.location_no != expected:
+                return False
+        return True
+
+    # The command for go_to; the changes of all steps count as one turn in
+    # turn_changes and are undone together
+    def travel(self, dest):
+        if not 0 <= dest < len(self.locations):
+            self.printout("Takega kraja ni.")
+        elif self.route(dest) is None:
+            self.printout("Tja ne znam priti.")
+        else:
+            self.walking = True
+            self.then(lambda: self.go_to(dest),
+                      partial(self.end_travel, turn_start=self.turn_start))
+
+    def end_travel(self, _, turn_start):
+        self.walking = False
+        self.turn_start = turn_start
+
+    # Complains if there were words that no response matched, and runs
+    # the process table
+    def end_turn(self, unmatched=None):
+        if unmatched:
+            if len(unmatched) == 1 and unmatched[0] < 16:
+                self.printout("Mar ne vidiš, da v to smer ni poti?")
+            else:
+                self.printout("Tega pa ne morem.")
+        self.process_events(self.process, 1)
+
+    # Runs the command, but PAUSE and a non-blocking anykey() suspend the
+    # turn instead of waiting; returns None when the turn is done, or the
+    # Suspend, which tells how long to wait before calling resume
+    def start_turn(self, command):
+        return self.run_suspending(lambda: self.run_command(command))
+
+    def resume(self, suspended):
+        return self.run_suspending(suspended.resume)
+
+    def run_suspending(self, func):
+        self.suspending = True
+        try:
+            func()
+        except self.Suspend as suspend:
+            return suspend
+        finally:
+            self.suspending = False
+        return None
+
+    # A file that is not a save store, like a position saved with pickle,
+    # is overwritten
+    def save_position(self, fname, slot=0):
+        with savestore.SaveStore(fname, self, overwrite=True) as store:
+            store.save(slot, self)
+
+    # Also reads positions that earlier versions saved with pickle
+    def load_position(self, fname, slot=0):
+        if savestore.is_save_store(fname):
+            with savestore.SaveStore(fname, self) as store:
+                store.load(slot, self)
+        else:
+            savestore.load_pickled(fname, self)
+        self.update_location()
+
+    #######################################
+    # History
+    # A turn is recorded when the next one starts (or when undoing), so a
+    # suspended turn is recorded whole. The change is kept as an array with
+    # an (offset, old value, new value) triple for each changed byte of the
+    # state
+    def record_turn(self, state=None):
+        if not self.history_size:
+            return
+        base = self.history_base
+        if state is None:
+            state = self.get_state()
+        if state == base:
+            return
+        delta = array(self.delta_type)
+        for i, (old, new) in enumerate(zip(base, state)):
+            if old != new:
+                delta.extend((i, old, new))
+        self.history.append(delta)
+        self.undone.clear()
+        self.history_base = state
+
+    def apply_delta(self, delta, column):
+        state = self.state
+        for i in range(0, len(delta), 3):
+            state[delta[i]] = delta[i + column]
+        self.history_base = self.get_state()
+
+    # Restores the state before the last turn; returns False if there is
+    # no turn to undo
+    def undo(self):
+        self.record_turn()
+        if not self.history:
+            return False
+        delta = self.history.pop()
+        self.apply_delta(delta, 1)
+        self.undone.append(delta)
+        return True
+
+    # Turns played since the last undo drop the undone ones
+    def redo(self):
+        self.record_turn()
+        if not self.undone:
+            return False
+        delta = self.undone.pop()
+        self.apply_delta(delta, 2)
+        self.history.append(delta)
+        return True
+
+    # Returns the flags and objects changed since the start of the turn,
+    # and whether the location changed
+    def turn_changes(self):
+        before, now = self.turn_start, self.state
+        if before == now:
+            return [], [], False
+        nflags, nstate = len(self.flags), len(now)
+        changed = [i for i in range(nstate) if before[i] != now[i]]
+        return ([i for i in changed if i < nflags],
+                [i - nflags for i in changed if nflags <= i < nstate - 1],
+                changed[-1] == nstate - 1)
+
+    #######################################
+    # Output; a front-end overrides these
+    def printout(self, msg):
+        self.output.append(msg)
+
+    def clear_screen(self):
+        pass
+
+    def anykey(self):
+        pass
+
+    def set_location_description(self, msg, dirs):
+        self.printout(msg)
+
+    def save(self):
+        self.do_save()
+
+    def load(self):
+        self.do_load()
+
+    #######################################
+    # Cheating
+    def ldesc(self, n):
+        return self.locations[n].description[:40]
+
+    def ldesci(self, n):
+        return self.ldesc(n), n
+
+    def lidesc(self, n):
+        return n, self.ldesc(n)
+
+    def repr_action(self, event, system, skipat=0, adddict=""):
+        ldesci = self.ldesci
+        lidesc = self.lidesc
+        if not system:
+            if event.word2 != 255:
+                tc = " ".join((self.index_to_word[event.word1],
+                              self.index_to_word[event.word2], adddict))
+            elif event.word1 != 255:
+                tc = " ".join((self.index_to_word[event.word1], adddict))
+            else:
+                tc = adddict
+        else:
+            tc = adddict
+
+        ta = []
+        for op, param1, param2 in event.conditions:
+            if self.Event.cond_ops[op][0] == "AT":
+                if skipat:
+                    continue
+                else:
+                    if tc:
+                        tc += "  [AT %s (%i)]" % ldesci(param1)
+                    else:
+                        tc = "AT %s (%i)" % ldesci(param1)
+            else:
+                s = "--> %s " % self.Event.cond_ops[op][0]
+                if param1:
+                    if op < 4:
+                        s += "%i (%s...) " % lidesc(param1)
+                    elif op < 10:
+                        s += "%i (%s) " % (param1,
+                                           self.objects[param1].description)
+                    elif op < 13:
+                        s += "%i " % param1
+                    else:
+                        s += "%i %i " % (param1, param2)
+                ta.append(s)
+
+        for action in event.actions:
+            tt = event.act_ops[action[0]]
+            atype = event.types[action[0]]
+            param1, param2 = (action[1] + (None, None))[:2]
+            if atype == self.Event.LOC:
+                tt += " %i (%s...)" % lidesc(param1)
+            elif atype == self.Event.MSG:
+                tt += " '%s'" % self.messages[param1]
+            elif atype == self.Event.OBJ:
+                tt += " '%s' (%i)" % (
+                    self.objects[param1].description, param1)
+            elif atype == self.Event.SWAP:
+                tt += " '%s' (%i) '%s' (%i)" % (
+                    self.objects[param1].description, param1,
+                    self.objects[param2].description, param2)
+            elif event.nparams[action[0]] == 1:
+                tt += " %i" % param1
+            elif event.nparams[action[0]] == 2:
+                tt += " %i %i" % (param1, param2)
+            ta.append(tt)
+        return tc, ta, not tc
+
+
+class Database:
+    # Bump when parsing changes, so that old caches are not used
+    CACHE_VERSION = 4
+
+    # Returns the database from the cache next to the snapshot if it is
+    # up to date, and parses the snapshot (and rewrites the cache) if not
+    @classmethod
+    def load(cls, name="kontra.sna", dbver=0):
+        key = b"QDB" + bytes([cls.CACHE_VERSION, dbver]) + \
+            Snapshot(name).digest()
+        cache_name = name + ".qdb"
+        try:
+            with open(cache_name, "rb") as f:
+                cached = f.read()
+            if cached[:len(key)] == key:
+                database = pickle.loads(memoryview(cached)[len(key):])
+                # The snapshot may have been moved with its cache
+                database.name = name
+                return database
+        except Exception:  # missing or corrupt cache; parse the snapshot
+            pass
+
+        database = cls(name, dbver)
+        try:
+            with open(cache_name, "wb") as f:
+                f.write(key + pickle.dumps(database, pickle.HIGHEST_PROTOCOL))
+        except OSError:
+            pass
+        return database
+
+    #######################################
+    # Initialization from an .sna file
+    def __init__(self, name="kontra.sna", dbver=0):
+        def single_string(ptr):
+            # TODO: Simplify
+            s = ""
+            while sna[ptr] != 0xe0:
+                s += chr(255 - sna[ptr])
+                ptr += 1
+            return s
+
+        def word(ptr):
+            return sna[ptr] + 256 * sna[ptr + 1]
+
+        def read_vocabulary():
+            vocabulary = {}
+            index_to_word = []
+            pv = self.pvocabulary
+            while sna[pv]:
+                index = sna[pv + 4]
+                w = "".join(chr(255 - x) for x in sna[pv:pv + 4]).strip()
+                vocabulary[w] = index
+                if index >= len(index_to_word):
+                    index_to_word += [None] * (index - len(index_to_word) + 1)
+                if not index_to_word[index]:
+                    index_to_word[index] = w
+                pv += 5
+            return vocabulary, index_to_word
+
+        def get_cond_table(ptr):
+            events = []
+            while sna[ptr]:
+                events.append(Quill.Event(sna, ptr, dbver))
+                ptr += 4
+            return events
+
+        def read_connections():
+            ptr = word(self.pconnections)
+            for location in self.locations:
+                while sna[ptr] != 0xff:
+                    location.connections[sna[ptr]] = sna[ptr + 1]
+                    ptr += 2
+                ptr += 1
+
+        # routes[src][dest] is the direction of the first step on a shortest
+        # way from src to dest, or 255 if there is none; found by a
+        # breadth-first search backwards from each dest
+        def find_routes():
+            nlocations = len(self.locations)
+            incoming = [[] for _ in range(nlocations)]
+            for src, location in enumerate(self.locations):
+                for direction, dest in location.connections.items():
+                    if dest < nlocations:
+                        incoming[dest].append((src, direction))
+            routes = [bytearray(b"\xff" * nlocations)
+                      for _ in range(nlocations)]
+            for dest in range(nlocations):
+                seen = {dest}
+                frontier = [dest]
+                while frontier:
+                    new_frontier = []
+                    for loc in frontier:
+                        for src, direction in incoming[loc]:
+                            if src not in seen:
+                                seen.add(src)
+                                routes[src][dest] = direction
+                                new_frontier.append(src)
+                    frontier = new_frontier
+            return [bytes(route) for route in routes]
+
+        def read_object_positions():
+            ptr = self.pobject_locations
+            for i in range(len(self.objects)):
+                self.objects[i].initial = sna[ptr + i]
+
+        sna = Snapshot(name)
+        self.name = name
+        self.db_hash = sna.digest()
+        self.dbver = dbver
+        ptr = sna.find_signature() + 13
+        self.nobjects_carry = sna[ptr]
+        self.nobjects = sna[ptr+1]
+        self.nlocations = sna[ptr+2]
+        self.nmessages = sna[ptr+3]
+        if dbver:
+            ptr += 1
+            self.nsystem_messages = sna[ptr+3]
+            self.pdictionary = ptr + 29
+
+        self.presponse = word(ptr+4)
+        self.pprocess = word(ptr+6)
+        self.pobjects = word(ptr+8)
+        self.plocations = word(ptr+10)
+        self.pmessages = word(ptr+12)
+
+        off = 2 if dbver else 0
+        self.pconnections = word(ptr + 14 + off)
+        self.pvocabulary = word(ptr+16 + off)
+        self.pobject_locations = word(ptr+18 + off)
+
+        if dbver:
+            psystem_messages = word(ptr+14)
+            self.system_messages = \
+                StringTable(sna, word(psystem_messages), self.nsystem_messages)
+            self.pobject_map = word(ptr+22)
+        else:
+            self.system_messages = [single_string(ptr) for ptr in [
+                27132, 27152, 27175, 27209, 27238, 27260, 27317, 27349, 27368,
+                27390, 27397, 27451, 27492, 27525, 27551, 27568, 27573, 27584,
+                27590, 27613, 27645, 27666, 27681, 27707, 27726]]
+            self.pobject_map = None
+
+        self.vocabulary, self.index_to_word = read_vocabulary()
+        # Games in other languages have none or only some of these words
+        self.dir_codes = [self.vocabulary[i]
+                          for i in ["SZ", "S", "SV", "Z", "V", "JZ", "J", "JV",
+                                    "NOTE", "VEN", "GOR", "DOL"]
+                          if i in self.vocabulary]
+
+        self.responses = get_cond_table(self.presponse)
+        self.process = get_cond_table(self.pprocess)
+        self.share_events()
+        self.response_index = Quill.index_events(self.responses)
+        descriptions = StringTable(sna, word(self.pobjects), self.nobjects)
+        self.objects = [Quill.Object(descriptions, i)
+                        for i in range(len(descriptions))]
+        read_object_positions()
+        descriptions = StringTable(sna, word(self.plocations), self.nlocations)
+        self.locations = [Quill.Location(descriptions, i)
+                          for i in range(len(descriptions))]
+        read_connections()
+        self.routes = find_routes()
+        self.messages = StringTable(sna, word(self.pmessages), self.nmessages)
+
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.share_events()
+
+    # Equal tests and actions of different events become the same tuples;
+    # they are shared only within the database, so nothing is kept after
+    # the database is gone
+    def share_events(self):
+        shared = {}
+        for event in self.responses + self.process:
+            event.share(shared)
+
+
+# Inverted indexes over both event tables, built in a single pass. They map
+# a location, object, flag or message to the (system, event) pairs that
+# mention it, in table order: responses (system 0) first, then process (1).
+class CrossReference:
+    flag_actions = ("PLUS", "MINUS", "SET", "CLEAR", "LET")
+
+    def __init__(self, database):
+        self.locations, self.objects, self.flags, self.messages = {}, {}, {}, {}
+        Event = Quill.Event
+
+        def add(index, key, system, event):
+            entries = index.setdefault(key, [])
+            if not entries or entries[-1][1] is not event:
+                entries.append((system, event))
+
+        for system, table in enumerate((database.responses, database.process)):
+            for event in table:
+                for op, param1, param2 in event.conditions:
+                    if op <= 1:
+                        add(self.locations, param1, system, event)
+                    elif 4 <= op <= 9:
+                        add(self.objects, param1, system, event)
+                    elif op >= 11:
+                        add(self.flags, param1, system, event)
+                for opcode, params in event.actions:
+                    atype = event.types[opcode]
+                    if atype == Event.LOC:
+                        add(self.locations, params[0], system, event)
+                    elif atype == Event.MSG:
+                        add(self.messages, params[0], system, event)
+                    elif atype in (Event.OBJ, Event.PLC):
+                        add(self.objects, params[0], system, event)
+                    elif atype == Event.SWAP:
+                        add(self.objects, params[0], system, event)
+                        add(self.objects, params[1], system, event)
+                    elif event.act_ops[opcode] in self.flag_actions:
+                        add(self.flags, params[0], system, event)
+
+        self.incoming = {}
+        for src, location in enumerate(database.locations):
+            for direction, dest in location.connections.items():
+                self.incoming.setdefault(dest, []).append((src, direction))
+
+    @staticmethod
+    def select(index, key, system):
+        entries = index.get(key, [])
+        if system is None:
+            return entries
+        return [entry for entry in entries if entry[0] == system]
+
+    # Events with AT or NOT AT the location, or GOTO to it
+    def location_events(self, loc, system=None):
+        return self.select(self.locations, loc, system)
+
+    def object_events(self, objno, system=None):
+        return self.select(self.objects, objno, system)
+
+    def flag_events(self, flagno, system=None):
+        return self.select(self.flags, flagno, system)
+
+    def message_events(self, msgno, system=None):
+        return self.select(self.messages, msgno, system)
+
+    # Connections that lead to the location, as (source, direction)
+    def approaches(self, loc):
+        return self.incoming.get(loc, [])
+
+
+# Counts and times events, conditions and actions; see Quill.set_profiler.
+# The statistics are [calls, matches, seconds], where a match is an event
+# that matched, a condition that held, or an action that ended the event.
+class Profiler:
+    def __init__(self):
+        self.events, self.conditions, self.actions = {}, {}, {}
+
+    @staticmethod
+    def count(stats, key, matched, seconds):
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = [0, 0, 0.0]
+        entry[0] += 1
+        if matched:
+            entry[1] += 1
+        entry[2] += seconds
+
+    # The same as Quill.process_events, but events are run by run_event
+    def process_events(self, data, table, system, word1=None, word2=None):
+        match = 0
+        try:
+            for k, event in enumerate(table):
+                res = self.run_event(event, data, system, word1, word2)
+                if res in [-1, 1]:
+                    return res
+                elif res:
+                    match = 1
+        except Quill.Suspend as suspend:
+            data.suspended_at(suspend, table, k, match, system, word1, word2)
+            raise
+        return match
+
+    # Quill.Event.__call__ with counters around the event and each
+    # condition; the actions are counted by the handlers from timed
+    def run_event(self, event, data, system, word1, word2):
+        timer = time.perf_counter
+        started = timer()
+        res = 0
+        try:
+            if system or event.matches(word1, word2):
+                for (opcode, _, _), (test, param1, param2) in \
+                        zip(event.conditions, event.tests):
+                    t = timer()
+                    held = test(data, param1, param2)
+                    self.count(self.conditions, opcode, held, timer() - t)
+                    if not held:
+                        break
+                else:
+                    res = event.run_actions(data, 0)
+        finally:
+            self.count(self.events, event, res, timer() - started)
+        return res
+
+    # Wraps the handler of an action, see Quill.set_profiler
+    def timed(self, opcode, handler):
+        def run(*params):
+            started = time.perf_counter()
+            res = None
+            try:
+                res = handler(*params)
+            finally:
+                self.count(self.actions, opcode, res,
+                           time.perf_counter() - started)
+            return res
+        return run
+
+    # Returns the statistics as dicts, the slowest first; events are
+    # labelled with their table, index and repr_action
+    def rows(self, game):
+        rows = []
+        for system, (table, events) in enumerate(
+                (("responses", game.responses), ("process", game.process))):
+            for index, event in enumerate(events):
+                if event in self.events:
+                    tc, ta, _ = game.repr_action(event, system)
+                    label = "; ".join(([tc] if tc else []) + ta)
+                    rows.append(("event", table, index, label,
+                                 self.events[event]))
+        act_ops = Quill.Event.ptas[game.dbver][0]
+        for kind, stats, names in (
+                ("condition", self.conditions,
+                 [name for name, _ in Quill.Event.cond_ops]),
+                ("action", self.actions, act_ops)):
+            for opcode, entry in stats.items():
+                rows.append((kind, None, opcode, names[opcode], entry))
+        rows.sort(key=lambda row: -row[4][2])
+        return [{"kind": kind, "table": table, "index": index, "label": label,
+                 "calls": calls, "matches": matches, "seconds": seconds}
+                for kind, table, index, label, (calls, matches, seconds)
+                in rows]
+
+    def report(self, game, limit=30):
+        lines = ["%10s %8s %8s  %s" % ("us", "calls", "matches", "")]
+        for row in self.rows(game)[:limit]:
+            where = row["kind"] if row["table"] is None \
+                else "%s %i" % (row["table"], row["index"])
+            lines.append("%10.1f %8i %8i  %s: %s"
+                         % (row["seconds"] * 1e6, row["calls"],
+                            row["matches"], where, row["label"]))
+        return "\n".join(lines)
+
+    def to_json(self, game):
+        return json.dumps(self.rows(game), indent=1, ensure_ascii=False)
+
+
+# The event tables translated into Python ahead of time: a function for the
+# process table and one for each pair of words in the response table (the
+# events that Quill.responses_for returns), in which the conditions are
+# inlined comparisons on Quill.state and the actions are direct calls of the
+# do_ methods. Quill.use_compiled runs them instead of Quill.process_events.
+# The compiled code is cached next to the snapshot.
+class CompiledTables:
+    # Bump when the generated code changes
+    VERSION = 2
+    # Each action is nested in the previous one; the actions of the few
+    # events with more (mostly tunes of BEEPs) are run by Event.run_actions
+    # once the inlined conditions hold
+    max_actions = 8
+
+    # Conditions as in Event.cond_ops; {0} and {1} are the parameters and
+    # {obj} is the offset of the object's location in the state
+    cond_exprs = ["state[-1] == {0}", "state[-1] != {0}",
+                  "state[-1] > {0}", "state[-1] < {0}",
+                  "state[{obj}] == state[-1]", "state[{obj}] != state[-1]",
+                  "state[{obj}] == %i" % Quill.Object.WORN,
+                  "state[{obj}] != %i" % Quill.Object.WORN,
+                  "state[{obj}] == %i" % Quill.Object.CARRIED,
+                  "state[{obj}] != %i" % Quill.Object.CARRIED,
+                  "{0} < data.random.randint(1, 100)",
+                  "not state[{0}]", "state[{0}]",
+                  "state[{0}] == {1}", "state[{0}] > {1}", "state[{0}] < {1}"]
+
+    @classmethod
+    def load(cls, database):
+        key = b"QPY" + bytes([cls.VERSION, Database.CACHE_VERSION,
+                              database.dbver]) + \
+            importlib.util.MAGIC_NUMBER + database.db_hash
+        cache_name = database.name + ".qpy"
+        try:
+            with open(cache_name, "rb") as f:
+                cached = f.read()
+            if cached[:len(key)] == key:
+                return cls(database, marshal.loads(cached[len(key):]))
+        except Exception:  # missing or corrupt cache; compile again
+            pass
+
+        tables = cls(database)
+        try:
+            with open(cache_name, "wb") as f:
+                f.write(key + marshal.dumps(tables.code))
+        except OSError:
+            pass
+        return tables
+
+    def __init__(self, database, code=None):
+        if code is None:
+            code = compile(self.source(database),
+                           "<%s>" % database.db_hash.hex(), "exec")
+        self.code = code
+        self.database = database
+        namespace = {"Suspend": Quill.Suspend, "suspended": self.suspended}
+        exec(code, namespace)
+        # Keyed by the identity of the tables, which the Database keeps
+        self.functions = {id(database.process): namespace["process"]}
+        for (word1, word2), table in database.response_index.items():
+            self.functions[id(table)] = \
+                namespace["responses_%i_%i" % (word1, word2)]
+
+    # Leaves the rest of the event and of the table for Suspend.resume, as
+    # Event.run_actions and Quill.process_events do
+    @staticmethod
+    def suspended(data, suspend, table, k, i, match, system, word1, word2):
+        if i is not None:
+            table[k].suspended(suspend, data, i)
+        data.suspended_at(suspend, table, k, match, system, word1, word2)
+
+    @classmethod
+    def source(cls, database):
+        lines = ["# Event tables of %s, generated by quill.CompiledTables"
+                 % database.db_hash.hex()]
+        lines += cls.function_source("process", database.process, database)
+        for (word1, word2), table in sorted(database.response_index.items()):
+            lines += cls.function_source(
+                "responses_%i_%i" % (word1, word2), table, database)
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def condition_source(cls, op, param1, param2, nobjects):
+        # Objects and flags out of range must raise IndexError as in Quill,
+        # so their conditions are copied from Event.cond_ops
+        if 4 <= op <= 9 and param1 >= nobjects or op >= 11 and param1 >= 64:
+            return Quill.Event.cond_ops[op][1].replace(
+                "param1", str(param1)).replace("param2", str(param2))
+        return cls.cond_exprs[op].format(param1, param2, obj=64 + param1)
+
+    @classmethod
+    def function_source(cls, fname, table, database):
+        act_ops = Quill.Event.ptas[database.dbver][0]
+        nobjects = len(database.objects)
+        lines = ["", "",
+                 "def %s(data, table, system, word1, word2):" % fname,
+                 "    state = data.state",
+                 "    match = 0"]
+        for k, event in enumerate(table):
+            conds = [cls.condition_source(op, param1, param2, nobjects)
+                     for op, param1, param2 in event.conditions]
+            lines.append("    # %i: %s" % (k, "; ".join(
+                Quill.Event.cond_ops[op][0] for op, _, _ in event.conditions)
+                + " -> " + " ".join(act_ops[op] if op < len(act_ops)
+                                    else str(op) for op, _ in event.actions)))
+            indent = "    "
+            if conds:
+                lines.append("    if %s:" % " and ".join(conds))
+                indent = "        "
+            if not event.actions:
+                lines.append(indent + "match = 1")
+                continue
+            if len(event.actions) > cls.max_actions:
+                lines += [indent + "try:",
+                          indent + "    res = table[%i].run_actions(data, 0)"
+                          % k]
+                index = "None"
+            else:
+                lines += [indent + "i = 0", indent + "try:"]
+                for i, (op, params) in enumerate(event.actions):
+                    inner = indent + "    " * (i + 1)
+                    if i:
+                        lines += [inner[4:] + "if not res:",
+                                  inner + "i = %i" % i]
+                    args = ", ".join(map(str, params))
+                    if op < len(act_ops):
+                        lines.append(inner + "res = data.do_%s(%s)"
+                                     % (act_ops[op].lower(), args))
+                    else:
+                        lines.append(inner + "res = data.handlers[%i](%s)"
+                                     % (op, args))
+                index = "i"
+            lines += [indent + "except Suspend as suspend:",
+                      indent + "    suspended(data, suspend, table, %i, %s, "
+                               "match, system, word1, word2)" % (k, index),
+                      indent + "    raise",
+                      indent + "if res == 1 or res == -1:",
+                      indent + "    return res",
+                      indent + "match = 1"]
+        lines.append("    return match")
+        return lines
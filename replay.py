@@ -0,0 +1,182 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Replays command logs - text files with a command per line - without the
+# GUI and without waiting on pauses. CHANCE is seeded, so a log always gives
+# the same transcript and final state. The logs are shared among a pool of
+# processes.
+#
+#     python replay.py [--seed 0] [--transcripts DIR] walkthrough.txt ...
+#
+# prints the number of commands, the score, the location and a hash of the
+# final state for each log. Lines starting with # are comments; a comment
+# "# state HASH" gives the expected hash (with the default seed), and a log
+# that ends in another state is reported and makes replay.py exit with an
+# error. The logs in walkthroughs/ are kept this way as regression checks.
+# With --compiled, the event tables are run by quill.CompiledTables; --check
+# replays each log with both and lists the logs where the transcript or the
+# final state differ.
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from quill import CompiledTables, Database, Quill, plain_text
+
+
+class Replay(Quill):
+    pauses = False
+
+
+# Returns the transcript and the final state
+def replay(database, commands, seed=0, tables=None):
+    game = Replay(database=database, seed=seed)
+    if tables is not None:
+        game.use_compiled(tables)
+    transcript = [plain_text("".join(msg + "<br>" for msg in game.output))]
+    for command in commands:
+        transcript.append("> %s\n%s" % (command,
+                                        plain_text(game.command(command))))
+    return "".join(transcript), game.get_state()
+
+
+def state_hash(state):
+    return hashlib.blake2b(state, digest_size=8).hexdigest()
+
+
+# Returns the commands and the expected hash of the final state, or None
+def read_log(fname):
+    commands, expected = [], None
+    with open(fname, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#"):
+                words = line[1:].split()
+                if len(words) == 2 and words[0] == "state":
+                    expected = words[1]
+            elif line:
+                commands.append(line)
+    return commands, expected
+
+
+#######################################
+# Worker processes
+database = None
+tables = None
+
+
+def init_worker(name, dbver, compiled=False):
+    global database, tables
+    database = Database.load(name, dbver)
+    if compiled:
+        tables = CompiledTables.load(database)
+
+
+def replay_file(fname, seed, transcripts=None):
+    commands, expected = read_log(fname)
+    transcript, state = replay(database, commands, seed, tables)
+    if transcripts:
+        out_name = os.path.join(transcripts, os.path.basename(fname) + ".out")
+        with open(out_name, "w", encoding="utf-8") as f:
+            f.write(transcript)
+    return fname, len(commands), state, expected
+
+
+# Returns the number of the first command after which the compiled tables
+# give a different transcript or state than the interpreter, or None
+def check_file(fname, seed):
+    commands, _ = read_log(fname)
+    interpreted = Replay(database=database, seed=seed)
+    compiled = Replay(database=database, seed=seed)
+    compiled.use_compiled(tables)
+    if interpreted.output != compiled.output or \
+            interpreted.get_state() != compiled.get_state():
+        return fname, len(commands), 0
+    for i, command in enumerate(commands):
+        if interpreted.command(command) != compiled.command(command) or \
+                interpreted.get_state() != compiled.get_state():
+            return fname, len(commands), i + 1
+    return fname, len(commands), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay command logs")
+    parser.add_argument("logs", nargs="+", metavar="LOG")
+    parser.add_argument("--snapshot", default="kontra.sna")
+    parser.add_argument("--dbver", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--transcripts", metavar="DIR",
+                        help="write the transcripts to this directory")
+    parser.add_argument("--compiled", action="store_true",
+                        help="run the event tables compiled to Python")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the compiled tables with the "
+                             "interpreter")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes (default: one per core)")
+    args = parser.parse_args()
+
+    if args.transcripts:
+        os.makedirs(args.transcripts, exist_ok=True)
+    nworkers = args.workers or os.cpu_count()
+    started = time.perf_counter()
+    ncommands = 0
+    compiled = args.compiled or args.check
+    if compiled:
+        # Compiles the tables once, before the workers load them
+        CompiledTables.load(Database.load(args.snapshot, args.dbver))
+    with ProcessPoolExecutor(nworkers, initializer=init_worker,
+                             initargs=(args.snapshot, args.dbver,
+                                       compiled)) as pool:
+        n = len(args.logs)
+        if args.check:
+            ndiffer = 0
+            for fname, length, differs in pool.map(
+                    check_file, args.logs, [args.seed] * n,
+                    chunksize=max(1, n // (4 * nworkers))):
+                ncommands += length
+                if differs is not None:
+                    ndiffer += 1
+                    print("%s: differs after command %i" % (fname, differs))
+            print("%i logs, %i commands, %i differ"
+                  % (n, ncommands, ndiffer))
+            if ndiffer:
+                sys.exit(1)
+            return
+        nwrong = 0
+        for fname, length, state, expected in pool.map(
+                replay_file, args.logs, [args.seed] * n,
+                [args.transcripts] * n,
+                chunksize=max(1, n // (4 * nworkers))):
+            ncommands += length
+            print("%s: %i commands, score %i, location %i, state %s"
+                  % (fname, length, state[30], state[-1], state_hash(state)))
+            if expected is not None and expected != state_hash(state):
+                nwrong += 1
+                print("%s: expected state %s" % (fname, expected))
+    elapsed = time.perf_counter() - started
+    print("%i logs, %i commands in %.2f s, %.0f commands/s"
+          % (len(args.logs), ncommands, elapsed, ncommands / elapsed))
+    if nwrong:
+        print("%i logs end in a different state than expected" % nwrong)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
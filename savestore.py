@@ -0,0 +1,144 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Saved positions, many slots to a file. The file starts with a header
+#
+#     magic, version, state size, number of slots, hash of the database
+#
+# followed by the slots, each a slot header (used, turns, timestamp) and a
+# copy of Quill.state. The file is memory-mapped, so saving and restoring
+# a slot is a copy between two buffers.
+
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+
+MAGIC = b"QSAV"
+VERSION = 1
+
+file_header = struct.Struct("<4sHHI16s")
+slot_header = struct.Struct("<BxxxId")
+
+
+# Opening a file that is not a save store raises ValueError, unless
+# overwrite is set; then it is replaced by an empty store
+class SaveStore:
+    def __init__(self, fname, game, nslots=16, overwrite=False):
+        self.state_size = len(game.state)
+        self.slot_size = slot_header.size + self.state_size
+        if os.path.exists(fname) and os.path.getsize(fname) and \
+                not (overwrite and not is_save_store(fname)):
+            self.f = open(fname, "r+b")
+            header = self.f.read(file_header.size)
+            if len(header) < file_header.size or \
+                    header[:len(MAGIC)] != MAGIC:
+                self.f.close()
+                raise ValueError("%s is not a save file" % fname)
+            magic, version, state_size, self.nslots, db_hash = \
+                file_header.unpack(header)
+            if version != VERSION or state_size != self.state_size or \
+                    db_hash != game.db_hash:
+                self.f.close()
+                raise ValueError("%s was saved from a different game" % fname)
+            if os.path.getsize(fname) < \
+                    file_header.size + self.nslots * self.slot_size:
+                self.f.close()
+                raise ValueError("%s is truncated" % fname)
+        else:
+            self.f = open(fname, "w+b")
+            self.nslots = nslots
+            self.f.write(file_header.pack(MAGIC, VERSION, self.state_size,
+                                          nslots, game.db_hash))
+            self.f.truncate(file_header.size + nslots * self.slot_size)
+        self.mm = mmap.mmap(self.f.fileno(), 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def slot_offset(self, slot):
+        if not 0 <= slot < self.nslots:
+            raise IndexError("no slot %i in a file with %i slots"
+                             % (slot, self.nslots))
+        return file_header.size + slot * self.slot_size
+
+    def save(self, slot, game):
+        off = self.slot_offset(slot)
+        slot_header.pack_into(self.mm, off, 1, game.turns, time.time())
+        off += slot_header.size
+        self.mm[off:off + self.state_size] = game.state
+
+    def load(self, slot, game):
+        off = self.slot_offset(slot)
+        used, turns, _ = slot_header.unpack_from(self.mm, off)
+        if not used:
+            raise KeyError("slot %i is empty" % slot)
+        off += slot_header.size
+        game.state[:] = self.mm[off:off + self.state_size]
+        game.turns = turns
+
+    # Returns (slot, turns, timestamp) for all used slots
+    def slots(self):
+        used = []
+        for slot in range(self.nslots):
+            header = slot_header.unpack_from(self.mm, self.slot_offset(slot))
+            if header[0]:
+                used.append((slot,) + header[1:])
+        return used
+
+
+def is_save_store(fname):
+    with open(fname, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Reads a position saved with pickle by earlier versions into game.state
+def load_pickled(fname, game):
+    with open(fname, "rb") as f:
+        flags = pickle.load(f)
+        object_locations = pickle.load(f)
+    # The flags were a list and could hold values that do not fit in a byte
+    flags = bytes(max(0, min(255, x)) for x in flags)
+    object_locations = bytes(object_locations)
+    if len(flags) != len(game.flags) or \
+            len(object_locations) != len(game.object_locations):
+        raise ValueError("%s was saved from a different game" % fname)
+    game.flags[:] = flags
+    game.object_locations[:] = object_locations
+    game.location_no = game.flags[2]
+
+
+def convert(pickle_name, store_name, game, slot=0):
+    load_pickled(pickle_name, game)
+    with SaveStore(store_name, game) as store:
+        store.save(slot, game)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("usage: savestore.py game.sna old-position new-position")
+        sys.exit(1)
+    from quill import Quill
+    convert(sys.argv[2], sys.argv[3], Quill(sys.argv[1]))
@@ -0,0 +1,204 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Serves a game to many players over TCP or a Unix socket.
+#
+# The protocol is line based: the client sends a command per line and the
+# server answers with the printed text, followed by the prompt "> " (without
+# a newline). The snapshot is parsed once; every connection only gets a
+# Quill with its own state, sharing the Database with all the others.
+#
+# PAUSE and ANYKEY suspend the turn: the text printed so far is sent, and
+# the turn resumes after the pause or after the player sends a line, while
+# the other sessions go on.
+#
+#     python server.py [--port 7777] [--max-sessions 100] [--idle 600]
+#     python server.py --bench 50 200
+
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+
+from quill import Database, Quill, plain_text
+
+PROMPT = "> "
+
+
+class Session(Quill):
+    def anykey(self):
+        if self.suspending:
+            raise self.Suspend(None)
+
+
+class Server:
+    def __init__(self, database, max_sessions=100, idle_timeout=600,
+                 pauses=True):
+        self.database = database
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # Without pauses, the sessions skip PAUSE and ANYKEY
+        self.pauses = pauses
+        self.sessions = set()
+        self.turns = 0
+        self.started = time.perf_counter()
+
+    async def handle(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"Too many players, try again later.\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        game = Session(database=self.database)
+        game.pauses = self.pauses
+        self.sessions.add(game)
+        try:
+            self.send(writer, "".join(msg + "<br>" for msg in game.output))
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(),
+                                                  self.idle_timeout)
+                    if not line:
+                        break
+                    command = line.decode("utf-8", "replace").strip()
+                    if command:
+                        await self.run_turn(game, reader, writer, command)
+                        self.turns += 1
+                    else:
+                        self.send(writer, "")
+                except asyncio.TimeoutError:
+                    writer.write(b"\nIdle for too long, bye.\n")
+                    break
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions.discard(game)
+            writer.close()
+
+    async def run_turn(self, game, reader, writer, command):
+        game.output = []
+        suspended = game.start_turn(command.upper())
+        while suspended:
+            self.send(writer, "".join(msg + "<br>" for msg in game.output),
+                      "Press Enter ..." if suspended.delay is None else "")
+            game.output = []
+            await writer.drain()
+            if suspended.delay is None:
+                await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            else:
+                await asyncio.sleep(suspended.delay)
+            suspended = game.resume(suspended)
+        self.send(writer, "".join(msg + "<br>" for msg in game.output))
+
+    @staticmethod
+    def send(writer, text, prompt=PROMPT):
+        writer.write((plain_text(text) + prompt).encode("utf-8"))
+
+    async def serve_tcp(self, host="127.0.0.1", port=7777):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve_unix(self, path):
+        return await asyncio.start_unix_server(self.handle, path)
+
+    def turns_per_second(self):
+        return self.turns / (time.perf_counter() - self.started)
+
+
+#######################################
+# Benchmark: many clients playing random commands against localhost
+async def read_reply(reader):
+    return (await reader.readuntil(PROMPT.encode())).decode("utf-8")
+
+
+async def play(port, commands):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await read_reply(reader)
+    for command in commands:
+        writer.write(command.encode() + b"\n")
+        await read_reply(reader)
+    writer.close()
+
+
+async def bench(database, nclients, nturns, seed=0):
+    server = Server(database, max_sessions=nclients, pauses=False)
+    tcp = await server.serve_tcp(port=0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    rand = random.Random(seed)
+    words = sorted(database.vocabulary)
+    scripts = [[" ".join(rand.sample(words, rand.randint(1, 2)))
+                for _ in range(nturns)]
+               for _ in range(nclients)]
+    server.turns, server.started = 0, time.perf_counter()
+    await asyncio.gather(*(play(port, script) for script in scripts))
+    tps = server.turns_per_second()
+    tcp.close()
+    await tcp.wait_closed()
+    return tps
+
+
+def session_size(database, n=1000):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    games = [Session(database=database) for _ in range(n)]
+    used = sum(stat.size_diff for stat in
+               tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    del games
+    return used / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a Quill game")
+    parser.add_argument("--snapshot", default="kontra.sna")
+    parser.add_argument("--dbver", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", metavar="PATH",
+                        help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-sessions", type=int, default=100)
+    parser.add_argument("--idle", type=float, default=600,
+                        help="disconnect players idle for this many seconds")
+    parser.add_argument("--bench", nargs=2, type=int,
+                        metavar=("CLIENTS", "TURNS"),
+                        help="measure throughput with local clients")
+    args = parser.parse_args()
+
+    database = Database(args.snapshot, args.dbver)
+    if args.bench:
+        nclients, nturns = args.bench
+        tps = asyncio.run(bench(database, nclients, nturns))
+        print("%i clients x %i turns: %.0f turns/s, %.0f bytes per session"
+              % (nclients, nturns, tps, session_size(database)))
+        return
+
+    async def serve():
+        server = Server(database, args.max_sessions, args.idle)
+        if args.unix:
+            listener = await server.serve_unix(args.unix)
+        else:
+            listener = await server.serve_tcp(args.host, args.port)
+        async with listener:
+            await listener.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+## Unquill: Copyright (C) 2003  Janez Demsar
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+# Explores the game by itself: a breadth-first search over game states,
+# starting from the state after reset(). Each state is tried with every
+# command the game reacts to - the words and word pairs of the response
+# table and the directions - and the states seen before are dropped. The
+# states of each depth are expanded by a pool of worker processes.
+#
+#     python solver.py [--location 42] [--max-depth 40] [--workers 4]
+#
+# prints the shortest command sequence that reaches the location or, without
+# --location, that gets the highest score (flags[30]).
+
+import argparse
+import hashlib
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from quill import Quill
+
+
+class Explorer(Quill):
+    # Nothing is undone, so no history is kept, and nobody waits for pauses
+    history_size = 0
+    pauses = False
+
+    # Nobody reads the output, so nothing is printed or described
+    def printout(self, msg):
+        pass
+
+    def update_location(self):
+        pass
+
+    # Runs the command from the given state and returns the new state.
+    # CHANCE is seeded by the state and the command, so that the same move
+    # always leads to the same state, also in another process
+    def step(self, state, command):
+        self.set_state(state)
+        self.random.seed(state + command.encode())
+        self.run_command(command)
+        return self.get_state()
+
+
+def state_key(state):
+    return hashlib.blake2b(state, digest_size=8).digest()
+
+
+#######################################
+# Worker processes
+explorer = None
+
+
+def init_worker(name, dbver):
+    global explorer
+    explorer = Explorer(name, dbver)
+    explorer.command_list = explorer.known_commands()
+
+
+# Returns {new state: (index of the parent in states, command number)}
+def expand(states):
+    children = {}
+    for parent, state in enumerate(states):
+        for command_no, command in enumerate(explorer.command_list):
+            child = explorer.step(state, command)
+            if child != state and child not in children:
+                children[child] = (parent, command_no)
+    return children
+
+
+#######################################
+# Search
+class Solver:
+    def __init__(self, name="kontra.sna", dbver=0, workers=None):
+        self.name, self.dbver, self.workers = name, dbver, workers
+        game = Explorer(name, dbver)
+        self.commands = game.known_commands()
+        self.start = game.get_state()
+        # Maps the key of every state seen to (key of parent, command number)
+        self.seen = {}
+        self.depth = 0
+        self.elapsed = 0
+
+    # Expands the states, in chunks spread over the pool if there is one;
+    # yields (parent state, command number, new state)
+    def expand_all(self, pool, frontier):
+        if pool is None:
+            results = [expand(frontier)]
+            chunks = [frontier]
+        else:
+            size = max(1, len(frontier) // (4 * (self.workers or
+                                                 os.cpu_count())))
+            chunks = [frontier[i:i + size]
+                      for i in range(0, len(frontier), size)]
+            results = pool.map(expand, chunks)
+        for chunk, children in zip(chunks, results):
+            for child, (parent, command_no) in children.items():
+                yield chunk[parent], command_no, child
+
+    # Searches until reaching the location or, if it is None, until there
+    # are no new states or a limit is hit; returns the best state found
+    def run(self, location=None, max_depth=40, max_states=2000000):
+        started = time.perf_counter()
+        self.seen = {state_key(self.start): None}
+        self.depth = 0
+        best = self.start
+        frontier = [self.start]
+
+        if self.workers == 1:
+            init_worker(self.name, self.dbver)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                       initargs=(self.name, self.dbver))
+        try:
+            while frontier and self.depth < max_depth and \
+                    len(self.seen) < max_states and \
+                    (location is None or best[-1] != location):
+                self.depth += 1
+                new_frontier = []
+                for parent, command_no, child in \
+                        self.expand_all(pool, frontier):
+                    key = state_key(child)
+                    if key in self.seen:
+                        continue
+                    self.seen[key] = (state_key(parent), command_no)
+                    new_frontier.append(child)
+                    if location is None:
+                        if child[30] > best[30]:
+                            best = child
+                    elif child[-1] == location and best[-1] != location:
+                        best = child
+                frontier = new_frontier
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.elapsed = time.perf_counter() - started
+        return best
+
+    # The commands that lead from the start to the state
+    def path(self, state):
+        path = []
+        link = self.seen[state_key(state)]
+        while link:
+            parent, command_no = link
+            path.append(self.commands[command_no])
+            link = self.seen[parent]
+        return path[::-1]
+
+    def states_per_second(self):
+        return len(self.seen) / self.elapsed if self.elapsed else 0
+
+
+# Peak resident memory of this process and of the largest worker, in MB
+def peak_memory():
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find a solution by search")
+    parser.add_argument("--snapshot", default="kontra.sna")
+    parser.add_argument("--dbver", type=int, default=0)
+    parser.add_argument("--location", type=int,
+                        help="reach this location instead of the best score")
+    parser.add_argument("--max-depth", type=int, default=40)
+    parser.add_argument("--max-states", type=int, default=2000000)
+    parser.add_argument("--workers", type=int,
+                        help="number of processes (default: one per core)")
+    args = parser.parse_args()
+
+    solver = Solver(args.snapshot, args.dbver, args.workers)
+    best = solver.run(args.location, args.max_depth, args.max_states)
+    path = solver.path(best)
+    if args.location is None:
+        print("Score %i in %i commands" % (best[30], len(path)))
+    elif best[-1] == args.location:
+        print("Location %i in %i commands" % (args.location, len(path)))
+    else:
+        print("Location %i not reached" % args.location)
+    for command in path:
+        print("    " + command)
+    print("%i states, depth %i, %.1f s, %.0f states/s, "
+          "peak memory %.1f MB (largest worker %.1f MB)"
+          % ((len(solver.seen), solver.depth, solver.elapsed,
+              solver.states_per_second()) + peak_memory()))
+
+
+if __name__ == "__main__":
+    main()